@@ -1,4 +1,7 @@
 from .server import WebManualsServer
+from .assets import WebManualsAssetCache, WebManualsAssetFetcher
 from .downloader import WebManualsManualDownloader
 from .parser import WebManualsPageParser
 from .fsibuilder import FsiWebManualsManualBuilder
+from .verifier import WebManualsCacheVerifier, WebManualsCacheReport
+from .history import WebManualsHistoryStore
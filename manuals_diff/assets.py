@@ -0,0 +1,269 @@
+'''
+Created on 19 Oct 2026
+
+@author: gareth
+'''
+import hashlib
+import json
+import os
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from urllib.parse import urlsplit
+
+class WebManualsAssetCache:
+    """A cache of the images and documents referenced by manual pages. Each
+    asset is stored once, named by the SHA-256 hash of its content, so an asset
+    used on many pages (or by many manuals, or under several URLs) only occupies
+    disk space once. An index maps each URL to its stored file along with the
+    HTTP validators (ETag/Last-Modified) used to re-validate it.
+
+    This object is threadsafe and may be shared between manual downloaders."""
+
+    _save_file_encoding = "UTF-8"
+
+    _index_filename = "assets.json"
+
+    _objects_dirname = "objects"
+
+    # Number of assets downloaded at the same time by a WebManualsAssetFetcher
+    _default_max_workers = 8
+
+    def __init__(self, cache_dir: Path):
+        """Creates an asset cache which stores assets (and its index) in the
+        supplied directory. Any previously cached index is loaded."""
+
+        self.cache_dir = cache_dir
+        self._objects_dir = cache_dir / WebManualsAssetCache._objects_dirname
+        self._objects_dir.mkdir(parents=True, exist_ok=True)
+        self._index_file = cache_dir / WebManualsAssetCache._index_filename
+
+        self._lock = threading.Lock()
+
+        # URLs already fetched or re-validated by this object, so each URL is
+        # only requested once however many pages refer to it
+        self._validated_urls = set()
+
+        # URL -> dict with keys "file", "etag" and "last_modified"
+        self._index = dict()
+        if self._index_file.is_file():
+            try:
+                with self._index_file.open(encoding=WebManualsAssetCache._save_file_encoding) as stream:
+                    self._index = json.loads(stream.read())
+            except ValueError:
+                # Corrupt index - assets will simply be downloaded again
+                self._index = dict()
+
+    def get_asset_file(self, url: str):
+        """Returns the Path of the cached copy of the asset at the specified
+        URL, or None if the asset has not been downloaded."""
+
+        with self._lock:
+            entry = self._index.get(url)
+
+        if entry:
+            asset_file = self.cache_dir / entry["file"]
+            if asset_file.is_file():
+                return asset_file
+
+        return None
+
+    def fetch(self, session: requests.Session, url: str):
+        """Downloads the asset at the specified URL into the cache, unless it
+        has already been fetched by this object. If the asset is already cached
+        then a conditional request is made and the asset is only downloaded
+        again if it has changed on the server. If session is None (offline
+        mode) then the cached copy is used without re-validation and no request
+        is made.
+
+        Returns the Path of the cached copy of the asset, or None if offline
+        and the asset is not cached. Raises an exception if the asset could not
+        be downloaded."""
+
+        cached_file = self.get_asset_file(url)
+
+        if session is None:
+            return cached_file
+
+        with self._lock:
+            already_validated = url in self._validated_urls
+            entry = dict(self._index.get(url, {}))
+
+        if cached_file and already_validated:
+            return cached_file
+
+        headers = dict()
+        if cached_file:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = session.get(url, headers=headers)
+
+        if response.status_code == 304 and cached_file:
+            # Not modified
+            asset_file = cached_file
+        else:
+            # No-op if the HTTP response code was 2xx. The exception message
+            # will include the URL so the caller knows which asset errored.
+            response.raise_for_status()
+            asset_file = self._store(response.content, url)
+            entry = {
+                "file": asset_file.relative_to(self.cache_dir).as_posix(),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")
+                }
+
+        with self._lock:
+            self._index[url] = entry
+            self._validated_urls.add(url)
+
+        return asset_file
+
+    def fetch_all(self,
+                  session: requests.Session,
+                  urls: list,
+                  max_workers: int = _default_max_workers):
+        """Concurrently fetches all of the assets at the supplied URLs (see
+        fetch()) and saves the index. Duplicate URLs are only fetched once.
+
+        Returns a dict mapping each URL to the Path of its cached copy. Assets
+        which could not be downloaded are left out of the returned dict, so any
+        links to them will continue to point at the server."""
+
+        with WebManualsAssetFetcher(self, session, max_workers) as fetcher:
+            fetches = {url: fetcher.submit(url) for url in urls}
+
+        asset_files = dict()
+        for url, fetch in fetches.items():
+            if fetch.result():
+                asset_files[url] = fetch.result()
+        return asset_files
+
+    def fetch_or_none(self, session: requests.Session, url: str):
+        """As fetch() but returns None, rather than raising an exception, if the
+        asset could not be downloaded. A missing asset should never stop a
+        manual being downloaded or built - links to it just keep pointing at
+        the server. The index is not saved - call save_index() once finished."""
+
+        try:
+            return self.fetch(session, url)
+        except Exception:
+            return None
+
+    def save_index(self):
+        """Writes the URL index to the cache directory."""
+
+        with self._lock:
+            index_as_string = json.dumps(self._index, indent=2, sort_keys=True)
+
+        self._write_atomically(self._index_file,
+                               (index_as_string + "\n").encode(WebManualsAssetCache._save_file_encoding))
+
+    def _store(self, content: bytes, url: str):
+        """Stores the supplied content under its content hash (keeping the file
+        extension from the URL) unless identical content is already stored.
+        Returns the Path of the stored file."""
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        suffix = PurePosixPath(urlsplit(url).path).suffix.lower()
+
+        # Split into sub-directories so no one directory gets too large
+        asset_file = self._objects_dir / content_hash[:2] / (content_hash + suffix)
+
+        if not asset_file.is_file():
+            asset_file.parent.mkdir(parents=True, exist_ok=True)
+            self._write_atomically(asset_file, content)
+
+        return asset_file
+
+    def _write_atomically(self, file_path: Path, content: bytes):
+        """Writes content to a temporary file then renames it to file_path, so
+        file_path is never left partially written."""
+
+        temp_path = file_path.with_name("{}.{}.{}.tmp".format(
+            file_path.name, os.getpid(), threading.get_ident()))
+        try:
+            with temp_path.open("wb") as stream:
+                stream.write(content)
+            os.replace(temp_path, file_path)
+        except:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+
+
+class WebManualsAssetFetcher:
+    """Concurrently fetches assets into a WebManualsAssetCache using a fixed
+    number of threads. Each thread has its own copy of the (logged in) session,
+    as it is not clear whether requests.Session is threadsafe (see
+    WebManualsServer). Each URL is only fetched once. Call close() (or use as a
+    context manager) once all URLs have been submitted - this waits for the
+    fetches to finish and saves the cache index."""
+
+    def __init__(self,
+                 asset_cache: WebManualsAssetCache,
+                 session: requests.Session,
+                 max_workers: int = WebManualsAssetCache._default_max_workers):
+        """Creates a fetcher which downloads assets into asset_cache using
+        copies of session. If session is None (offline mode) only already
+        cached assets are returned."""
+
+        self._asset_cache = asset_cache
+        self._session = session
+        self._fetches = dict()
+
+        self._thread_local = threading.local()
+        self._thread_sessions = list()
+        self._lock = threading.Lock()
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            initializer=self._start_thread)
+
+    def submit(self, url: str):
+        """Starts fetching the asset at the specified (absolute) URL, unless it
+        has already been submitted. Returns a Future whose result is the Path
+        of the cached copy, or None if it could not be downloaded."""
+
+        if url not in self._fetches:
+            self._fetches[url] = self._executor.submit(self._fetch, url)
+        return self._fetches[url]
+
+    def close(self):
+        """Waits for all submitted fetches to finish, closes the per-thread
+        sessions and saves the cache index."""
+
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for thread_session in self._thread_sessions:
+                thread_session.close()
+            self._thread_sessions = list()
+        self._asset_cache.save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_thread(self):
+        """Gives the current (pool) thread its own copy of the session."""
+
+        if self._session is None:
+            thread_session = None
+        else:
+            thread_session = requests.Session()
+            thread_session.headers.update(self._session.headers)
+            thread_session.cookies.update(self._session.cookies)
+            thread_session.auth = self._session.auth
+            thread_session.proxies.update(self._session.proxies)
+            thread_session.verify = self._session.verify
+            with self._lock:
+                self._thread_sessions.append(thread_session)
+
+        self._thread_local.session = thread_session
+
+    def _fetch(self, url: str):
+        return self._asset_cache.fetch_or_none(self._thread_local.session, url)
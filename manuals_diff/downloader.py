@@ -3,22 +3,36 @@ Created on 18 Dec 2019
 
 @author: gareth
 '''
+import hashlib
+import json
+import os
 import requests
+import threading
 from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+from .assets import WebManualsAssetCache
+from .history import WebManualsHistoryStore
 from .metadata import WebManualsManualMetadata
+from .parser import WebManualsPageParser
 
 class WebManualsManualDownloader:
     """Downloads a particular manual from a WebManuals site. Once an object has
     been instantited, the properties can be used to obtain data about the
     manual. Call download() to actually download the pages to a directory.
     """
+    
+    _save_file_encoding = "UTF-8"
+    
+    _page_hashes_filename = "page_hashes.json"
 
     def __init__(self,
                  session: requests.Session,
                  manual_id: int,
                  metadata_url: str,
                  page_url: str,
-                 destination: Path):
+                 destination: Path,
+                 asset_cache: WebManualsAssetCache = None,
+                 keep_history: bool = True):
         """Creates a downloader to download the specified manual from
         WebManuals. The session must already be logged into the site. The
         given URLs will be used to fetch the metadata and the pages. These
@@ -26,25 +40,82 @@ class WebManualsManualDownloader:
         methods in this class.
         
         Files will be written to disk as they are downloaded. Any previous
-        download will be continued from the point it ended."""
+        download will be continued from the point it ended.
+        
+        If an asset_cache is supplied then the images and attachments
+        referenced by the pages will be downloaded into it too.
+        
+        If online (session is not None) the metadata is always fetched to check
+        for a new revision of the manual. If there is one, the pages of the
+        previous revision are discarded so the new revision will be downloaded.
+        If keep_history is True then each completely downloaded revision is
+        kept in a WebManualsHistoryStore (see record_revision()) so that it
+        can be built later (see get_revision())."""
     
         self.page_url = page_url
         self.session = session
         self.destination_dir = destination
+        self.asset_cache = asset_cache
+        
+        # IDs (as strings) of the only pages which can be present, or None if
+        # any page can be. Set for a partial revision from the history.
+        self.stored_page_ids = None
+        
+        if keep_history:
+            self.history = WebManualsHistoryStore(self.destination_dir / "history")
+        else:
+            self.history = None
+        
+        # Page number -> {"page_id": ..., "sha256": ...} for each page written
+        # by this (or a previous) downloader. Used to verify the cache.
+        self._page_hashes_lock = threading.Lock()
+        self.page_hashes = dict()
+        page_hashes_file = self.destination_dir / self._page_hashes_filename
+        if page_hashes_file.is_file():
+            try:
+                with page_hashes_file.open(encoding=self._save_file_encoding) as stream:
+                    loaded_hashes = json.loads(stream.read())
+                self.page_hashes = {int(page_number): entry
+                                    for page_number, entry in loaded_hashes.items()}
+            except ValueError:
+                # Corrupt - the pages will be reported as unhashed on verify
+                self.page_hashes = dict()
 
         # Get MetaData for manual
         self.manual_metadata = WebManualsManualMetadata(self.destination_dir)
-        if not self.manual_metadata.load_from_cache():
-            # Not cached, must download it
+        is_cached = self.manual_metadata.load_from_cache()
+        
+        # Whether the cached metadata file was valid when this downloader was
+        # created (it is re-written if not). Reported by the cache verifier.
+        self.metadata_was_cached = is_cached
+        
+        if not is_cached and self.session is None:
+            raise ValueError("Cached metadata for manual {} in '{}' is missing or "
+                             "invalid and cannot be downloaded when offline"
+                             .format(manual_id, self.destination_dir))
+        
+        if not is_cached or self.session:
+            # Not cached (must download it) or checking for a new revision
             params={
                 "manualId": str(manual_id),
                 "revision": "undefined"
                 }
             meadata_response = self.session.post(metadata_url, params=params)
             meadata_response.raise_for_status() # no-op if 2xx response code
+            metadata_json = meadata_response.json()
+            
+            if is_cached and (str(metadata_json.get("revisionId")) != 
+                              str(self.manual_metadata.revision_id)):
+                # New revision published - keep the old one in the history
+                # (even if only partly downloaded, e.g. a single chapter) then
+                # discard its pages. If it cannot be stored the exception is
+                # raised before any pages are discarded. Without a history the
+                # old pages are simply discarded as they are out of date.
+                self.record_revision(allow_partial=True)
+                self._discard_pages()
         
             # Also caches the downloaded metadata 
-            self.manual_metadata.parse_json(meadata_response.json())
+            self.manual_metadata.parse_json(metadata_json)
 
     @property
     def revision(self):
@@ -72,39 +143,241 @@ class WebManualsManualDownloader:
         returns the Pathg to the first page of the manual."""
         return self.destination_dir / "page{:08d}".format(page_number)
         
-    def download(self):
+    @property
+    def base_url(self):
+        """The protocol and domain of the WebManuals site this manual is
+        downloaded from, e.g. 'https://babcock.webmanuals.aero'."""
+        url_parts = urlsplit(self.page_url)
+        return "{}://{}".format(url_parts.scheme, url_parts.netloc)
+        
+    def download(self,
+                 chapters: list = None,
+                 page_numbers: list = None,
+                 page_ids: list = None,
+                 force: bool = False):
         """Actually download the pages of this manual into the destination
         directory specified in the constructor. The directory will be created if
         it does not already exist. Pages will only be downloaded if there is not
         already a file for that page present in the destination directory 
-        supplied in the constructor.
+        supplied in the constructor, unless force is True in which case the
+        selected pages are always downloaded again (e.g. to refresh a chapter).
+        
+        By default every page is downloaded. A subset of pages can be selected
+        by chapter (number or name), page number (or range of page numbers) or
+        page ID - see WebManualsManualMetadata.select_page_numbers().
         
         Returns the directory containing the downloaded metadata and pages."""
         
         self.destination_dir.mkdir(parents=True, exist_ok=True)
         
-        page_number = 0
-        for chapter in self.manual_metadata.chapters:
-            for page_id in chapter.pages:
-                dest_file = self.get_page_file(page_number)
-                
-                if not dest_file.is_file():
-                    text = self._get_page_snippet(page_id)
-                    self._write_to_file(text, dest_file)
-                
-                page_number += 1
+        selected_page_numbers = self.manual_metadata.select_page_numbers(
+            chapters, page_numbers, page_ids)
+        
+        try:
+            for page_number in selected_page_numbers:
+                self.download_page(page_number, force)
+        finally:
+            self.save_page_hashes()
+        
+        self.download_assets(selected_page_numbers)
+        
+        self.record_revision()
         
         return self.destination_dir
 
-    def _write_to_file(self, text: str, file_path: Path):
+    def download_page(self, page_number: int, force: bool = False):
+        """Downloads the specified page (zero-indexed) of this manual into the
+        destination directory, unless a file for that page is already present
+        and force is False. The destination directory must already exist.
+        
+        Returns the Path of the file containing the page."""
+        
+        dest_file = self.get_page_file(page_number)
+        
+        if force or not dest_file.is_file():
+            page_id = self.manual_metadata.get_page_id(page_number)
+            text = self._get_page_snippet(page_id)
+            self._write_to_file(text, dest_file)
+            
+            with self._page_hashes_lock:
+                self.page_hashes[page_number] = {
+                    "page_id": page_id,
+                    "sha256": self.hash_file(dest_file)
+                    }
+        
+        return dest_file
+    
+    def hash_file(self, file_path: Path):
+        """Returns the SHA-256 hash of the contents of the specified file as a
+        hex string."""
+        with file_path.open("rb") as stream:
+            return hashlib.sha256(stream.read()).hexdigest()
+    
+    def save_page_hashes(self):
+        """Writes the hashes of the downloaded pages to the destination
+        directory so that the pages can later be verified."""
+        
+        with self._page_hashes_lock:
+            hashes_as_string = json.dumps({str(page_number): entry
+                                           for page_number, entry in sorted(self.page_hashes.items())},
+                                          indent=2)
+        
+        # Written atomically - an interrupted write would otherwise leave every
+        # page unverifiable
+        page_hashes_file = self.destination_dir / self._page_hashes_filename
+        self._write_to_file((hashes_as_string + "\n").encode(self._save_file_encoding),
+                            page_hashes_file)
+
+    def record_revision(self, allow_partial: bool = False):
+        """Appends the current revision of this manual to the history store, if
+        every page has been downloaded and the revision is not already stored.
+        If allow_partial is True then the revision is stored (and marked as
+        partial) even if only some pages have been downloaded - this is done
+        when a new revision is found so that no downloaded page is lost.
+        Returns True if the revision was appended. Called automatically by
+        download()."""
+        
+        if not self.history or self.history.has_revision(self.revision_id):
+            return False
+        
+        page_files = dict()
+        for page_number, page_id in enumerate(self.manual_metadata.get_all_pages()):
+            page_file = self.get_page_file(page_number)
+            if page_file.is_file():
+                page_files[page_id] = page_file
+            elif not allow_partial:
+                # Incomplete (e.g. partial) download
+                return False
+        
+        if not page_files:
+            # Nothing downloaded so nothing to keep
+            return False
+        
+        partial = len(page_files) < len(set(self.manual_metadata.get_all_pages()))
+        return self.history.append_revision(self.revision_id,
+                                            self.revision,
+                                            self.manual_metadata.get_json(),
+                                            page_files,
+                                            partial)
+    
+    def get_revision(self, revision_id):
+        """Returns a downloader for the specified revision of this manual, as
+        kept in the history store. The pages of the revision are reconstructed
+        into a sub-directory of the destination directory (if not already
+        there) - for a partial revision only the stored pages are. The
+        returned downloader works offline and can be passed to a builder to
+        build the historical revision. If revision_id is the current revision
+        then this downloader is returned."""
+        
+        if str(revision_id) == str(self.revision_id):
+            return self
+        
+        if not self.history:
+            raise ValueError("Manual '{}' has no history so no revision {}"
+                             .format(self.name, revision_id))
+        
+        revision_dir = self.destination_dir / "revisions" / str(revision_id)
+        revision_metadata = WebManualsManualMetadata(revision_dir)
+        if not revision_metadata.load_from_cache():
+            # Also caches the metadata for the downloader created below
+            revision_metadata.parse_json(self.history.get_metadata_json(revision_id))
+        
+        revision_downloader = WebManualsManualDownloader(None,
+                                                         self.id,
+                                                         None,
+                                                         self.page_url,
+                                                         revision_dir,
+                                                         self.asset_cache,
+                                                         keep_history=False)
+        
+        is_partial = self.history.is_partial(revision_id)
+        for page_number, page_id in enumerate(revision_metadata.get_all_pages()):
+            page_file = revision_downloader.get_page_file(page_number)
+            if not page_file.is_file():
+                try:
+                    page = self.history.get_page(revision_id, page_id)
+                except ValueError:
+                    if is_partial:
+                        # Never downloaded - build a selection of the pages
+                        # which were instead
+                        continue
+                    raise
+                self._write_to_file(page, page_file)
+        
+        if is_partial:
+            revision_downloader.stored_page_ids = set(self.history.get_page_ids(revision_id))
+        
+        return revision_downloader
+    
+    def _discard_pages(self):
+        """Deletes the downloaded pages (and their hashes) of the current
+        revision."""
+        
+        for page_number in range(0, self.manual_metadata.get_number_pages()):
+            page_file = self.get_page_file(page_number)
+            if page_file.exists():
+                page_file.unlink()
+        
+        with self._page_hashes_lock:
+            self.page_hashes = dict()
+        self.save_page_hashes()
+    
+    def get_asset_url(self, url: str):
+        """Returns the absolute URL of an image or attachment URL as it appears
+        in a page (which may be relative to the WebManuals site)."""
+        return urljoin(self.page_url, url)
+    
+    def get_asset_file(self, url: str):
+        """Returns a Path object which gives the location of the downloaded copy
+        of the image or attachment with the given URL (as it appears in a page),
+        or None if it has not been downloaded or there is no asset cache."""
+        if self.asset_cache:
+            return self.asset_cache.get_asset_file(self.get_asset_url(url))
+        else:
+            return None
+    
+    def download_assets(self, page_numbers: list):
+        """Downloads the images and attachments referenced by the specified
+        (already downloaded) pages into the asset cache supplied in the
+        constructor. The assets are downloaded concurrently and each one is only
+        downloaded once, however many pages refer to it. Does nothing (and
+        returns an empty dict) if there is no asset cache or if offline - any
+        assets already cached are still used by the builder.
+        
+        Returns a dict mapping the absolute URL of each asset to the Path of its
+        downloaded copy."""
+        
+        if not self.asset_cache or self.session is None:
+            return dict()
+        
+        urls = list()
+        for page_number in page_numbers:
+            parser = WebManualsPageParser(self.get_page_file(page_number),
+                                          self.manual_metadata.get_page_id(page_number),
+                                          page_number,
+                                          self.id)
+            urls.extend(self.get_asset_url(url) for url in parser.asset_urls())
+        
+        return self.asset_cache.fetch_all(self.session, urls)
+
+    def _write_to_file(self, text, file_path: Path):
         """Writes the specified text string to a file at the specified path. Any
-        existing file will be truncated."""
+        existing file will be replaced. The text is written to a temporary file
+        which is then renamed, so a partially written file is never left at the
+        specified path (e.g. if the program is killed mid-write). If text is
+        bytes (e.g. a page from the history) it is written unchanged."""
+        temp_path = file_path.with_name(file_path.name + ".tmp")
         try:
-            with file_path.open("w") as stream:
-                print(text, file=stream)
+            if isinstance(text, bytes):
+                with temp_path.open("wb") as stream:
+                    stream.write(text)
+            else:
+                with temp_path.open("w") as stream:
+                    print(text, file=stream)
+            os.replace(temp_path, file_path)
         except:
-            if file_path.exists():
-                file_path.unlink()
+            if temp_path.exists():
+                temp_path.unlink()
             raise
 
 
@@ -4,14 +4,30 @@ Created on 30 Jan 2020
 @author: gareth
 '''
 
+from .assets import WebManualsAssetFetcher
 from .downloader import WebManualsManualDownloader
 from .parser import WebManualsPageParser
 from pathlib import Path
+import os
+import queue
+import re
+import threading
 
 class FsiWebManualsManualBuilder:
     """Builds a wiki markup version of the FSIs manual from the previously
     downloaded files."""
     
+    # Maximum number of downloaded pages waiting to be parsed in pipelined mode
+    _default_queue_size = 16
+    
+    # Placed on the pipeline queue once the download thread has finished
+    _end_of_pages = None
+    
+    # In pipelined mode asset links are replaced by these placeholders while
+    # parsing, then by the link to the downloaded asset once all are fetched
+    _asset_placeholder = "manuals-diff-asset-{:08d}"
+    _asset_placeholder_regex = re.compile(r"manuals-diff-asset-(\d{8})")
+    
     def __init__(self, dest_file: Path, downloader: WebManualsManualDownloader):
         """Created a new FSI builder."""
         self._dest_file = dest_file
@@ -21,23 +37,233 @@ class FsiWebManualsManualBuilder:
         """Returns the text with all whitespace stripped and lowercased."""
         return ''.join(text.split()).lower()
     
-    def build(self):
+    def build(self,
+              chapters: list = None,
+              page_numbers: list = None,
+              page_ids: list = None,
+              revision_id = None):
         """Parse the downloaded files supplied in the constructor and create the
-        wiki markup file in the location supplied in the constructor."""
+        wiki markup file in the location supplied in the constructor.
         
-        content = "{{MARKDOWN}}\n\n"
-        current_title_slug = ""
-        for page_number in range(0, self._downloader.manual_metadata.get_number_pages()):
+        If revision_id is supplied then that revision of the manual is built
+        from the downloader's history (see
+        WebManualsManualDownloader.get_revision()) rather than the current
+        revision.
+        
+        By default every page is built. A subset of pages can be selected by
+        chapter (number or name), page number (or range of page numbers) or page
+        ID - see WebManualsManualMetadata.select_page_numbers(). Only the
+        selected pages need to have been downloaded. Links to pages outside the
+        selection will point to the WebManuals site rather than within the
+        built file."""
+        
+        if revision_id is not None:
+            revision_builder = FsiWebManualsManualBuilder(self._dest_file,
+                                                          self._downloader.get_revision(revision_id))
+            return revision_builder.build(chapters, page_numbers, page_ids)
+        
+        selected_page_numbers, local_page_ids = self._select_pages(chapters,
+                                                                   page_numbers,
+                                                                   page_ids)
+        
+        parsed_pages = (self._parse_page(page_number, local_page_ids)
+                        for page_number in selected_page_numbers)
+        self._write_markup(parsed_pages)
+    
+    def download_and_build(self,
+                           chapters: list = None,
+                           page_numbers: list = None,
+                           page_ids: list = None,
+                           queue_size: int = _default_queue_size,
+                           force: bool = False):
+        """Downloads and builds the selected pages (see build()) with the
+        download and the parsing overlapped. Pages are downloaded in a
+        background thread and passed to this thread for parsing as soon as each
+        one is available, so parsing is done while waiting on the network.
+        
+        At most queue_size downloaded pages will be waiting to be parsed - once
+        this many are queued the download pauses until the parser catches up.
+        Pages already present in the download directory are not downloaded
+        again unless force is True. If the downloader has an asset cache then
+        the images and attachments found while parsing each page are
+        downloaded concurrently, and the links to them are filled in once they
+        have all been downloaded. Any exception raised by the download is
+        re-raised here."""
+        
+        selected_page_numbers, local_page_ids = self._select_pages(chapters,
+                                                                   page_numbers,
+                                                                   page_ids)
+        self._downloader.destination_dir.mkdir(parents=True, exist_ok=True)
+        
+        page_queue = queue.Queue(maxsize=queue_size)
+        stop_downloading = threading.Event()
+        download_errors = list()
+        
+        def enqueue(item):
+            """Puts item on the queue, waiting while the queue is full. Returns
+            False (without queueing item) if the parser has given up."""
+            while not stop_downloading.is_set():
+                try:
+                    page_queue.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def download_pages():
+            """Downloads each selected page and queues its page number."""
+            try:
+                for page_number in selected_page_numbers:
+                    self._downloader.download_page(page_number, force)
+                    if not enqueue(page_number):
+                        return
+            except Exception as error:
+                download_errors.append(error)
+            finally:
+                enqueue(self._end_of_pages)
+        
+        download_thread = threading.Thread(target=download_pages,
+                                           name="download-manual-{}".format(self._downloader.id),
+                                           daemon=True)
+        download_thread.start()
+        
+        # Assets are downloaded by one pool of threads for the whole manual.
+        # asset_urls holds the page URL of each placeholder.
+        if self._downloader.asset_cache:
+            asset_fetcher = WebManualsAssetFetcher(self._downloader.asset_cache,
+                                                   self._downloader.session)
+        else:
+            asset_fetcher = None
+        asset_urls = list()
+        
+        def asset_placeholder(url):
+            """Starts downloading the asset (if not already started) and
+            returns a placeholder for the link to it."""
+            if asset_fetcher:
+                asset_fetcher.submit(self._downloader.get_asset_url(url))
+            asset_urls.append(url)
+            return self._asset_placeholder.format(len(asset_urls) - 1)
+        
+        # Pages are parsed in the order they are downloaded but stored by page
+        # number, so the output is always assembled in manual order
+        parsed_pages = dict()
+        try:
+            while True:
+                page_number = page_queue.get()
+                if page_number is self._end_of_pages:
+                    break
+                parsed_pages[page_number] = self._parse_page(page_number,
+                                                             local_page_ids,
+                                                             asset_placeholder)
+        finally:
+            stop_downloading.set()
+            download_thread.join()
+            self._downloader.save_page_hashes()
+            if asset_fetcher:
+                asset_fetcher.close()
+        
+        if download_errors:
+            raise download_errors[0]
         
-            file = self._downloader.get_page_file(page_number)
-            page_id = self._downloader.manual_metadata.get_page_id(page_number)
-            
-            parser = WebManualsPageParser(file, page_id, page_number,
-                                          self._downloader.id)
+        def replace_placeholder(match):
+            """Returns the link to the downloaded asset, or the original URL if
+            it could not be downloaded."""
+            url = asset_urls[int(match.group(1))]
+            return self._asset_link(url) or url
         
-            # TODO: track max revision and most recent date
+        def linked_pages():
+            """Yields the parsed pages, in order, with asset links filled in."""
+            for page_number in selected_page_numbers:
+                title, page_markup = parsed_pages[page_number]
+                yield title, self._asset_placeholder_regex.sub(replace_placeholder,
+                                                               page_markup)
+        
+        self._write_markup(linked_pages())
+        
+        self._downloader.record_revision()
+    
+    def _select_pages(self,
+                      chapters: list = None,
+                      page_numbers: list = None,
+                      page_ids: list = None):
+        """Returns a tuple of the list of selected page numbers and the set of
+        page IDs which will be present in the output. The set is None if the
+        whole manual is selected.
+        
+        If the downloader only has some pages (a partial revision from the
+        history) then by default only those pages are selected. Raises
+        ValueError if an explicit selection includes any other page."""
+        
+        metadata = self._downloader.manual_metadata
+        selected_page_numbers = metadata.select_page_numbers(chapters,
+                                                             page_numbers,
+                                                             page_ids)
+        
+        stored_page_ids = self._downloader.stored_page_ids
+        if stored_page_ids is not None:
+            if chapters is None and page_numbers is None and page_ids is None:
+                selected_page_numbers = [page_number for page_number in selected_page_numbers
+                                         if str(metadata.get_page_id(page_number)) in stored_page_ids]
+            else:
+                missing_page_ids = [metadata.get_page_id(page_number)
+                                    for page_number in selected_page_numbers
+                                    if str(metadata.get_page_id(page_number)) not in stored_page_ids]
+                if missing_page_ids:
+                    raise ValueError("Revision {} of manual '{}' is partial and "
+                                     "does not have page IDs {} (stored page IDs: {})"
+                                     .format(self._downloader.revision_id,
+                                             self._downloader.name,
+                                             missing_page_ids,
+                                             sorted(stored_page_ids)))
+        
+        if len(selected_page_numbers) == metadata.get_number_pages():
+            # Whole manual - every internal link is to a page in this file
+            local_page_ids = None
+        else:
+            local_page_ids = {metadata.get_page_id(page_number)
+                              for page_number in selected_page_numbers}
+        
+        return selected_page_numbers, local_page_ids
+    
+    def _parse_page(self, page_number: int, local_page_ids: set = None,
+                    asset_link = None):
+        """Parses the downloaded file for the specified page. Returns a tuple of
+        the page title and the page content as wiki markup. Asset links are
+        replaced using asset_link (see WebManualsPageParser) which defaults to
+        _asset_link()."""
+        
+        file = self._downloader.get_page_file(page_number)
+        page_id = self._downloader.manual_metadata.get_page_id(page_number)
+        
+        parser = WebManualsPageParser(file, page_id, page_number,
+                                      self._downloader.id,
+                                      asset_link=asset_link or self._asset_link)
+        
+        # TODO: track max revision and most recent date
+        
+        return parser.title(), parser.sanitised_wiki_markup(local_page_ids,
+                                                            self._downloader.base_url)
+    
+    def _asset_link(self, url: str):
+        """Returns a link to the downloaded copy of the image or attachment
+        with the given URL, relative to the destination file supplied in the
+        constructor. Returns None if the asset has not been downloaded."""
+        
+        asset_file = self._downloader.get_asset_file(url)
+        if asset_file:
+            return Path(os.path.relpath(asset_file, self._dest_file.parent)).as_posix()
+        else:
+            return None
+    
+    def _write_markup(self, parsed_pages):
+        """Concatenates the supplied (title, markup) tuples, in order, adding a
+        heading wherever the title changes, and writes the result to the
+        destination file supplied in the constructor."""
+        
+        content = "{{MARKDOWN}}\n\n"
+        current_title_slug = ""
+        for new_title, page_markup in parsed_pages:
         
-            new_title = parser.title()
             if new_title and not new_title.isspace():
                 new_title_slug = self._slugify(new_title)
                 if current_title_slug != new_title_slug:
@@ -45,7 +271,7 @@ class FsiWebManualsManualBuilder:
                     content += "\n\n# {}\n\n".format(new_title)
                     current_title_slug = new_title_slug
         
-            content += parser.sanitised_wiki_markup()
+            content += page_markup
         
 
         with self._dest_file.open("w") as stream:
@@ -0,0 +1,321 @@
+'''
+Created on 19 Oct 2026
+
+@author: gareth
+'''
+import difflib
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+
+class WebManualsHistoryStore:
+    """Stores every revision of a manual in a compact form. Each page has a
+    pack file holding its successive versions: the first version is stored in
+    full, as is at least every snapshot_interval'th version after it. The
+    others are stored as a line-based delta against the previous version (or
+    in full if that is smaller). Everything is
+    zlib compressed. A page which has not changed between revisions is not
+    stored again, so only the changed pages of a new revision take up space.
+
+    Any version can be reconstructed from the nearest preceding full snapshot,
+    so at most snapshot_interval - 1 deltas need applying.
+
+    An index file records, for each revision, the metadata and which version
+    of each page belongs to it, and the position of every version in its pack
+    file so a version can be read without reading the versions before its
+    snapshot."""
+
+    _save_file_encoding = "UTF-8"
+
+    _index_filename = "history.json"
+
+    _pages_dirname = "pages"
+
+    _metadata_dirname = "metadata"
+
+    _default_snapshot_interval = 10
+
+    # Pack record types
+    _full_record = 0
+    _delta_record = 1
+
+    # Pack record header: record type then payload length
+    _record_header = struct.Struct(">BI")
+
+    # Delta instructions: copy lines [start, end) of the previous version, or
+    # insert the following number of bytes
+    _copy_instruction = b"C"
+    _insert_instruction = b"I"
+    _copy_args = struct.Struct(">II")
+    _insert_args = struct.Struct(">I")
+
+    def __init__(self,
+                 history_dir: Path,
+                 snapshot_interval: int = _default_snapshot_interval):
+        """Creates a history store which keeps its files in the supplied
+        directory. Any previously stored history is loaded."""
+
+        self.history_dir = history_dir
+        self.snapshot_interval = snapshot_interval
+        self._pages_dir = history_dir / WebManualsHistoryStore._pages_dirname
+        self._metadata_dir = history_dir / WebManualsHistoryStore._metadata_dirname
+        self._index_file = history_dir / WebManualsHistoryStore._index_filename
+
+        self._pages_dir.mkdir(parents=True, exist_ok=True)
+        self._metadata_dir.mkdir(parents=True, exist_ok=True)
+
+        # "page_versions" maps page ID to a list with an entry for each version
+        # in its pack: [byte offset, record length, version of the snapshot it
+        # is built from]. "revisions" is a list (oldest first) of dicts with the
+        # keys "revision_id", "revision_name", "partial" and "pages" - which
+        # maps page ID to the (0-based) version of that page in the revision.
+        if self._index_file.is_file():
+            # Unlike the other caches a corrupt index cannot just be discarded:
+            # the pack files would then be overwritten and the history lost
+            try:
+                with self._index_file.open(encoding=WebManualsHistoryStore._save_file_encoding) as stream:
+                    self._index = json.loads(stream.read())
+                self._index["page_versions"]
+                self._index["revisions"]
+            except (ValueError, KeyError, TypeError) as error:
+                raise ValueError("History index '{}' is corrupt ({}). Restore it "
+                                 "from a backup or move the history directory "
+                                 "aside to start a new history."
+                                 .format(self._index_file, error))
+        else:
+            self._index = {"page_versions": {}, "revisions": []}
+
+    @property
+    def revision_ids(self):
+        """List of the IDs of the stored revisions, oldest first."""
+        return [revision["revision_id"] for revision in self._index["revisions"]]
+
+    def has_revision(self, revision_id):
+        """Returns True if the specified revision has been stored."""
+        return self._find_revision(revision_id) is not None
+
+    def is_partial(self, revision_id):
+        """Returns True if only some of the pages of the specified revision
+        were stored (because only some had been downloaded)."""
+        return self._get_revision(revision_id).get("partial", False)
+
+    def get_page_ids(self, revision_id):
+        """Returns a list of the IDs (as strings) of the pages stored for the
+        specified revision. For a partial revision this is only the pages that
+        had been downloaded."""
+        return list(self._get_revision(revision_id)["pages"])
+
+    def append_revision(self,
+                        revision_id,
+                        revision_name: str,
+                        metadata_json: dict,
+                        page_files: dict,
+                        partial: bool = False):
+        """Stores a new revision of the manual. page_files maps the ID of every
+        page in the revision to the Path of the file containing that page. If
+        partial is True then page_files need only contain the pages that were
+        downloaded and the revision is marked as partial. Returns False (and
+        stores nothing) if the revision is already stored, otherwise True."""
+
+        if self.has_revision(revision_id):
+            return False
+
+        page_versions = self._index["page_versions"]
+        revision_pages = dict()
+
+        for page_id, page_file in page_files.items():
+            key = str(page_id)
+            with page_file.open("rb") as stream:
+                content = stream.read()
+
+            version_count = len(page_versions.get(key, []))
+            previous = self._read_version(key, version_count - 1) if version_count else None
+            if previous == content:
+                # Unchanged since the last revision
+                revision_pages[key] = version_count - 1
+            else:
+                self._append_version(key, content, previous)
+                revision_pages[key] = version_count
+
+        metadata_as_bytes = json.dumps(metadata_json).encode(WebManualsHistoryStore._save_file_encoding)
+        self._write_atomically(self._get_metadata_file(revision_id),
+                               zlib.compress(metadata_as_bytes))
+
+        self._index["revisions"].append({
+            "revision_id": revision_id,
+            "revision_name": revision_name,
+            "partial": partial,
+            "pages": revision_pages
+            })
+        self._save_index()
+        return True
+
+    def get_metadata_json(self, revision_id):
+        """Returns the metadata JSON (as a dict) of the specified revision."""
+
+        self._get_revision(revision_id) # raises ValueError if not stored
+        with self._get_metadata_file(revision_id).open("rb") as stream:
+            metadata_as_bytes = zlib.decompress(stream.read())
+        return json.loads(metadata_as_bytes.decode(WebManualsHistoryStore._save_file_encoding))
+
+    def get_page(self, revision_id, page_id: int):
+        """Returns the content (as bytes) of the specified page as it was in the
+        specified revision. Raises ValueError if the revision or page is not
+        stored."""
+
+        revision = self._get_revision(revision_id)
+        try:
+            version = revision["pages"][str(page_id)]
+        except KeyError:
+            raise ValueError("Revision {} has no page with ID {}"
+                             .format(revision_id, page_id))
+        return self._read_version(str(page_id), version)
+
+    def _find_revision(self, revision_id):
+        """Returns the index entry for the specified revision or None."""
+        for revision in self._index["revisions"]:
+            if str(revision["revision_id"]) == str(revision_id):
+                return revision
+        return None
+
+    def _get_revision(self, revision_id):
+        """Returns the index entry for the specified revision. Raises ValueError
+        if it is not stored."""
+        revision = self._find_revision(revision_id)
+        if revision is None:
+            raise ValueError("No revision {} in history (stored revisions: {})"
+                             .format(revision_id, self.revision_ids))
+        return revision
+
+    def _get_pack_file(self, page_key: str):
+        return self._pages_dir / "{}.pack".format(page_key)
+
+    def _get_metadata_file(self, revision_id):
+        return self._metadata_dir / "{}.json.z".format(revision_id)
+
+    def _read_version(self, page_key: str, version: int):
+        """Reconstructs the specified version of a page from its pack file. Only
+        the nearest preceding full snapshot and the deltas after it are read."""
+
+        versions = self._index["page_versions"][page_key]
+        snapshot_offset = versions[versions[version][2]][0]
+        end_offset = versions[version][0] + versions[version][1]
+
+        with self._get_pack_file(page_key).open("rb") as stream:
+            stream.seek(snapshot_offset)
+            records = stream.read(end_offset - snapshot_offset)
+
+        header = WebManualsHistoryStore._record_header
+        content = None
+        position = 0
+        while position < len(records):
+            record_type, length = header.unpack_from(records, position)
+            position += header.size
+            payload = zlib.decompress(records[position:position + length])
+            position += length
+            if record_type == WebManualsHistoryStore._full_record:
+                content = payload
+            else:
+                content = self._apply_delta(content, payload)
+        return content
+
+    def _append_version(self, page_key: str, content: bytes,
+                        previous: bytes = None):
+        """Appends a new version to the pack file of a page and records where
+        it is in the index. previous is the content of the preceding version
+        (if any). Any data beyond the versions recorded in the index (e.g. from
+        an interrupted append) is discarded first."""
+
+        versions = self._index["page_versions"].setdefault(page_key, [])
+        version = len(versions)
+
+        full_payload = zlib.compress(content)
+        record_type, payload = WebManualsHistoryStore._full_record, full_payload
+        snapshot = version
+
+        # Store a delta unless that would mean applying snapshot_interval or
+        # more deltas to reconstruct this version
+        if versions and version - versions[-1][2] < self.snapshot_interval:
+            delta_payload = zlib.compress(self._make_delta(previous, content))
+            if len(delta_payload) < len(full_payload):
+                record_type, payload = WebManualsHistoryStore._delta_record, delta_payload
+                snapshot = versions[-1][2]
+
+        if versions:
+            valid_length = versions[-1][0] + versions[-1][1]
+        else:
+            valid_length = 0
+
+        pack_file = self._get_pack_file(page_key)
+        with pack_file.open("r+b" if pack_file.exists() else "wb") as stream:
+            stream.truncate(valid_length)
+            stream.seek(valid_length)
+            stream.write(WebManualsHistoryStore._record_header.pack(record_type, len(payload)))
+            stream.write(payload)
+
+        record_length = WebManualsHistoryStore._record_header.size + len(payload)
+        versions.append([valid_length, record_length, snapshot])
+
+    def _make_delta(self, previous: bytes, content: bytes):
+        """Returns a delta which turns previous into content, as a sequence of
+        instructions to copy ranges of lines from previous or insert bytes."""
+
+        previous_lines = previous.splitlines(keepends=True)
+        lines = content.splitlines(keepends=True)
+
+        delta = bytearray()
+        matcher = difflib.SequenceMatcher(None, previous_lines, lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                delta += WebManualsHistoryStore._copy_instruction
+                delta += WebManualsHistoryStore._copy_args.pack(i1, i2)
+            elif j2 > j1:
+                inserted = b"".join(lines[j1:j2])
+                delta += WebManualsHistoryStore._insert_instruction
+                delta += WebManualsHistoryStore._insert_args.pack(len(inserted))
+                delta += inserted
+        return bytes(delta)
+
+    def _apply_delta(self, previous: bytes, delta: bytes):
+        """Returns the result of applying a delta made by _make_delta()."""
+
+        previous_lines = previous.splitlines(keepends=True)
+        copy_args = WebManualsHistoryStore._copy_args
+        insert_args = WebManualsHistoryStore._insert_args
+
+        content = bytearray()
+        position = 0
+        while position < len(delta):
+            instruction = delta[position:position + 1]
+            position += 1
+            if instruction == WebManualsHistoryStore._copy_instruction:
+                start, end = copy_args.unpack_from(delta, position)
+                position += copy_args.size
+                content += b"".join(previous_lines[start:end])
+            else:
+                (length,) = insert_args.unpack_from(delta, position)
+                position += insert_args.size
+                content += delta[position:position + length]
+                position += length
+        return bytes(content)
+
+    def _save_index(self):
+        index_as_string = json.dumps(self._index, indent=2)
+        self._write_atomically(self._index_file,
+                               (index_as_string + "\n").encode(WebManualsHistoryStore._save_file_encoding))
+
+    def _write_atomically(self, file_path: Path, content: bytes):
+        """Writes content to a temporary file then renames it to file_path, so
+        file_path is never left partially written."""
+
+        temp_path = file_path.with_name(file_path.name + ".tmp")
+        try:
+            with temp_path.open("wb") as stream:
+                stream.write(content)
+            os.replace(temp_path, file_path)
+        except:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
@@ -4,6 +4,7 @@ Created on 18 Dec 2019
 @author: gareth
 '''
 import json
+import os
 from pathlib import Path
 
 class WebManualsManualMetadata:
@@ -47,6 +48,7 @@ class WebManualsManualMetadata:
         self.chapters = None
         
         self._pages = None
+        self._json = None
     
     def load_from_cache(self):
         """Attempts to load metadata from the saved metadata file in the
@@ -100,10 +102,35 @@ class WebManualsManualMetadata:
             raise ValueError("Metadata does not contain required key: {}"
                              .format(str(key_error)))
         
+        self._json = json_dict
+        
         if cache_it:
-            metadata_as_string = json.dumps(json_dict, indent=2)
-            with self._cache_filename.open(mode='w', encoding=WebManualsManualMetadata._save_file_encoding) as stream:
+            self.save_to_cache()
+
+    def save_to_cache(self):
+        """Saves the JSON this metadata was parsed from in a file in the
+        cache_dir supplied in the constructor to be read by load_from_cache().
+        The file is replaced atomically so it is never left partially written.
+        Can be used to repair an invalid cached file."""
+        
+        if self._json is None:
+            raise ValueError("No metadata has been parsed so none can be cached")
+        
+        metadata_as_string = json.dumps(self._json, indent=2)
+        temp_filename = self._cache_filename.with_name(self._cache_filename.name + ".tmp")
+        try:
+            with temp_filename.open(mode='w', encoding=WebManualsManualMetadata._save_file_encoding) as stream:
                 print(metadata_as_string, file=stream)
+            os.replace(temp_filename, self._cache_filename)
+        except:
+            if temp_filename.exists():
+                temp_filename.unlink()
+            raise
+
+    def get_json(self):
+        """Returns the JSON dict this metadata was parsed from (as supplied to
+        parse_json() or loaded from cache), or None if not yet parsed."""
+        return self._json
 
     def add_chapter(self, name: str = ""):
         """Adds another (optionally named) chapter to the end of the current
@@ -157,6 +184,84 @@ class WebManualsManualMetadata:
             else:
                 raise ValueError("Manual '{}' has no chapter {} (last chapter: {})"
                                  .format(self.name, chapter_number, last_chapter))
+
+    def get_chapter_number(self, chapter):
+        """Returns the (0-based) number of the specified chapter. The chapter
+        may be given as a chapter number or as a chapter name. Names are
+        compared ignoring case and whitespace. Raises ValueError if no such
+        chapter exists."""
+        
+        last_chapter = self.get_last_chapter()
+        if isinstance(chapter, int):
+            if 0 <= chapter <= last_chapter:
+                return chapter
+        else:
+            wanted_name = ''.join(str(chapter).split()).lower()
+            for chapter_number in range(0, last_chapter + 1):
+                name = self.chapters[chapter_number].name or ""
+                if ''.join(name.split()).lower() == wanted_name:
+                    return chapter_number
+        
+        raise ValueError("Manual '{}' has no chapter {} (last chapter: {})"
+                         .format(self.name, chapter, last_chapter))
+    
+    def get_first_page_number(self, chapter_number: int):
+        """Returns the page number (zero-indexed, across the whole manual) of
+        the first page of the specified chapter."""
+        
+        self.get_pages(chapter_number) # raises ValueError if no such chapter
+        return sum(len(chapter.pages) for chapter in self.chapters[:chapter_number])
+    
+    def select_page_numbers(self,
+                            chapters: list = None,
+                            page_numbers: list = None,
+                            page_ids: list = None):
+        """Returns a sorted list of the (zero-indexed) page numbers selected by
+        the supplied criteria. The selection is the union of:
+        
+          * every page of the given chapters (numbers or names)
+          * the given page numbers - each item may be a single page number or a
+            range object, e.g. [3, range(10, 20)]
+          * the pages with the given page IDs
+        
+        If no criteria are supplied (all are None) then every page of the
+        manual is selected. Raises ValueError if any chapter, page number or
+        page ID does not exist in this manual."""
+        
+        number_pages = self.get_number_pages()
+        
+        if chapters is None and page_numbers is None and page_ids is None:
+            return list(range(0, number_pages))
+        
+        selected = set()
+        
+        for chapter in chapters or []:
+            chapter_number = self.get_chapter_number(chapter)
+            first_page = self.get_first_page_number(chapter_number)
+            chapter_length = len(self.chapters[chapter_number].pages)
+            selected.update(range(first_page, first_page + chapter_length))
+        
+        for item in page_numbers or []:
+            numbers = item if isinstance(item, range) else [item]
+            for page_number in numbers:
+                if not 0 <= page_number < number_pages:
+                    raise ValueError("Manual '{}' has no page {} (last page: {})"
+                                     .format(self.name, page_number, number_pages - 1))
+                selected.add(page_number)
+        
+        if page_ids:
+            all_pages = self.get_all_pages()
+            page_numbers_by_id = {str(page_id): page_number
+                                  for page_number, page_id in enumerate(all_pages)}
+            for page_id in page_ids:
+                try:
+                    selected.add(page_numbers_by_id[str(page_id)])
+                except KeyError:
+                    raise ValueError("Manual '{}' has no page with ID {}"
+                                     .format(self.name, page_id))
+        
+        return sorted(selected)
+
     def get_all_pages(self):
         """Gets the list of page IDs for the entire manual. This is cached on
         first access. The cache will be nulled if add_page() or add_chapter() is
@@ -16,14 +16,27 @@ class WebManualsPageParser:
     values so repeated calls will cause repeated processing.
     """
     
-    def __init__(self, filename: Path, page_id: int, page_index: int, manual_id: int):
+    # Links to files with these extensions are treated as attachments to be
+    # downloaded along with the page (images are always downloaded)
+    _attachment_extensions = (".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt",
+                              ".pptx", ".txt", ".csv", ".zip", ".png", ".jpg",
+                              ".jpeg", ".gif", ".svg", ".bmp", ".tif", ".tiff")
+    
+    def __init__(self, filename: Path, page_id: int, page_index: int, manual_id: int,
+                 asset_link = None):
         """Reads in the specified file ready for information to be accessed via
-        the other methods of this class."""
+        the other methods of this class.
+        
+        If supplied, asset_link is called with the URL of each image and
+        attachment (as returned by asset_urls()) and should return the link to
+        use in its place, e.g. to a locally downloaded copy, or None to leave
+        the URL unchanged."""
         self._d = pyquery.PyQuery(filename=filename)
         
         self.page_id = page_id
         self.page_index = page_index
         self.manual_id = manual_id
+        self._asset_link = asset_link
         
         # Match [LabelText](</reader/#/5678/p/1234>)
         # Capture label and page id (1234 above) where 5678 is the manual ID
@@ -83,6 +96,34 @@ class WebManualsPageParser:
         else:
             return None
         
+    def _asset_attributes(self, content: pyquery.PyQuery):
+        """Yields a tuple of (element, attribute name) for each image and
+        attachment link in the supplied content."""
+        
+        for img in content("img[src]"):
+            yield img, "src"
+        
+        for a in content("a[href]"):
+            href = a.get("href")
+            path = href.split("#")[0].split("?")[0].lower()
+            if path.endswith(self._attachment_extensions):
+                yield a, "href"
+    
+    def asset_urls(self):
+        """Returns a list of the URLs of the images and attachments referenced
+        by the manual content, in the order they appear. URLs are exactly as
+        they appear in the page so may be relative to the WebManuals site."""
+        
+        content = self._d("div.section")
+        return [element.get(attribute)
+                for element, attribute in self._asset_attributes(content)]
+        
+    def has_content(self):
+        """Returns True if the page contains the manual content section (the
+        div.section element), i.e. looks like a valid downloaded page."""
+        
+        return len(self._d("div.section")) > 0
+        
     def raw_content(self):
         """Returns a string containing an HTML snippet - the part we are
         actually interested in - the bit that contains the manual content."""
@@ -97,6 +138,8 @@ class WebManualsPageParser:
           * removing empty(!!) links
           * removing empty formatting <div>s (e.g. which just clear float)
           * separating consecutive tables so they aren't concatonated
+          * replacing image/attachment URLs (if asset_link was supplied to the
+            constructor)
           * removing non-ascii characters"""
         
         # content = self._d("div.controlledSectionView")
@@ -134,6 +177,13 @@ class WebManualsPageParser:
         style_divs = content("div[style='clear: both; line-height: 1px;']")
         style_divs.remove()
         
+        # Point images/attachments at local copies
+        if self._asset_link:
+            for element, attribute in self._asset_attributes(content):
+                new_link = self._asset_link(element.get(attribute))
+                if new_link:
+                    element.set(attribute, new_link)
+        
         html_snippet = content.html()
         
         if strip_non_ascii:
@@ -156,17 +206,35 @@ class WebManualsPageParser:
         wiki_text = parser.handle(self.sanitised_content())
         return wiki_text
     
-    def sanitised_wiki_markup(self):
+    def sanitised_wiki_markup(self, local_page_ids: set = None, base_url: str = ""):
         """Returns the page of wiki markup with modifications ready to be
         concatonated with the other pages of the manual. Modifications include:
           * adding an anchor at the top of each page
           * replacing links to pages in the same document with relative links.
-          """
+        
+        If local_page_ids is supplied then only links to those pages are
+        replaced with relative links. Links to any other page (e.g. one not
+        included in a partial build) are instead made absolute by prefixing
+        them with base_url, so they point back to the WebManuals reader."""
         content = '<span id="page_id_{}" />\n\n'.format(self.page_id)
         content += self.wiki_markup()
         
-        content = re.sub(self._internal_link_regex,
-                         r"[\1](#page_id_\2)",
-                         content)
+        if local_page_ids is None:
+            content = re.sub(self._internal_link_regex,
+                             r"[\1](#page_id_\2)",
+                             content)
+        else:
+            local_page_ids = {str(page_id) for page_id in local_page_ids}
+            
+            def replace_link(match):
+                """Returns the replacement markup for a single internal link."""
+                label, page_id = match.group(1), match.group(2)
+                if page_id in local_page_ids:
+                    return "[{}](#page_id_{})".format(label, page_id)
+                else:
+                    return "[{}](<{}/reader/#/{}/p/{}>)".format(
+                        label, base_url, self.manual_id, page_id)
+            
+            content = re.sub(self._internal_link_regex, replace_link, content)
         
-        return content
\ No newline at end of file
+        return content
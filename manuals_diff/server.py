@@ -3,6 +3,7 @@ Created on 18 Dec 2019
 
 @author: gareth
 '''
+from .assets import WebManualsAssetCache
 from .downloader import WebManualsManualDownloader
 
 import json
@@ -41,7 +42,9 @@ class WebManualsServer:
         so only one login will be performed. If thread_safe is True then each
         downloader will have their own session. This is provided because there
         is some discrepency in the documentation as to whether requests.Session
-        is thread safe.
+        is thread safe. For the same reason, images and attachments are always
+        downloaded using a separate copy of the session per thread (see
+        WebManualsAssetFetcher).
         
         If offline is True then the server will not create sessions for the
         manual downloaders. Use this for totally offline operations. Any attempt
@@ -58,6 +61,9 @@ class WebManualsServer:
         self.site_id = site_id
         self._chache_dir = cache_dir
         
+        # Shared by all manuals so common images are only downloaded once
+        self._asset_cache = WebManualsAssetCache(cache_dir / "assets")
+        
         self.offline = offline
         self._set_up_username_password()
         
@@ -167,7 +173,8 @@ class WebManualsServer:
                                           manual_id, 
                                           self.metadata_url,
                                           self.page_url,
-                                          destination_dir)
+                                          destination_dir,
+                                          self._asset_cache)
 
 
 
@@ -0,0 +1,158 @@
+'''
+Created on 19 Oct 2026
+
+@author: gareth
+'''
+from .downloader import WebManualsManualDownloader
+from .metadata import WebManualsManualMetadata
+from .parser import WebManualsPageParser
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+
+class WebManualsCacheReport:
+    """The result of verifying the downloaded pages of a manual. The problems
+    property maps the page number of each bad page to a description of what is
+    wrong with it (one of the problem constants below)."""
+
+    MISSING = "missing"
+    EMPTY = "empty"
+    UNPARSEABLE = "unparseable HTML"
+    NO_CONTENT = "no div.section content"
+    HASH_MISMATCH = "hash mismatch"
+    STALE = "page ID differs from metadata"
+
+    def __init__(self, manual_id: int, metadata_valid: bool):
+        """Creates an empty report for the specified manual."""
+        self.manual_id = manual_id
+        self.metadata_valid = metadata_valid
+        self.pages_checked = 0
+        self.problems = dict()
+
+        # Pages which are otherwise OK but have no stored hash (e.g. downloaded
+        # before hashes were recorded) so could not be fully checked
+        self.unhashed = list()
+
+    @property
+    def bad_page_numbers(self):
+        """Sorted list of the page numbers of the pages with problems."""
+        return sorted(self.problems)
+
+    @property
+    def is_ok(self):
+        """True if the metadata and every checked page are valid."""
+        return self.metadata_valid and not self.problems
+
+    def __str__(self):
+        lines = ["Manual {}: checked {} pages, {} bad, {} unhashed"
+                 .format(self.manual_id, self.pages_checked,
+                         len(self.problems), len(self.unhashed))]
+        if not self.metadata_valid:
+            lines.append("  metadata: missing or invalid")
+        for page_number in self.bad_page_numbers:
+            lines.append("  page {}: {}".format(page_number,
+                                                self.problems[page_number]))
+        return "\n".join(lines)
+
+
+class WebManualsCacheVerifier:
+    """Checks that the downloaded pages of a manual are complete and
+    uncorrupted, and optionally re-downloads any bad pages. Pages are checked
+    in parallel."""
+
+    def __init__(self, downloader: WebManualsManualDownloader):
+        """Creates a verifier for the pages downloaded by the supplied
+        downloader."""
+        self._downloader = downloader
+
+    def verify(self,
+               chapters: list = None,
+               page_numbers: list = None,
+               page_ids: list = None,
+               max_workers: int = None):
+        """Checks every downloaded page of the manual (or just the pages
+        selected as per WebManualsManualMetadata.select_page_numbers()) and
+        returns a WebManualsCacheReport. Each page file must be present,
+        non-empty, contain parseable HTML with a div.section element, and match
+        the hash (and page ID) recorded when it was downloaded."""
+
+        metadata = self._downloader.manual_metadata
+        selected_page_numbers = metadata.select_page_numbers(chapters,
+                                                             page_numbers,
+                                                             page_ids)
+
+        # The downloader re-writes an invalid metadata file when it is created
+        # so also check whether it was valid then. Re-read the file too in case
+        # it has been damaged since.
+        cached_metadata = WebManualsManualMetadata(self._downloader.destination_dir)
+        metadata_valid = (self._downloader.metadata_was_cached and
+                          cached_metadata.load_from_cache())
+        report = WebManualsCacheReport(self._downloader.id, metadata_valid)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self._check_page, selected_page_numbers)
+            for page_number, (problem, hashed) in zip(selected_page_numbers,
+                                                      results):
+                report.pages_checked += 1
+                if problem:
+                    report.problems[page_number] = problem
+                elif not hashed:
+                    report.unhashed.append(page_number)
+
+        return report
+
+    def repair(self, report: WebManualsCacheReport):
+        """Re-downloads the bad pages listed in the supplied report (and their
+        images/attachments). Pages which were fine are not touched. If the
+        cached metadata was invalid it is re-written from the downloader's
+        metadata (which was downloaded afresh when the cache was invalid).
+        Returns a new report from verifying just the re-downloaded pages."""
+
+        if not report.metadata_valid:
+            self._downloader.manual_metadata.save_to_cache()
+            self._downloader.metadata_was_cached = True
+
+        bad_page_numbers = report.bad_page_numbers
+
+        try:
+            for page_number in bad_page_numbers:
+                self._downloader.download_page(page_number, force=True)
+        finally:
+            self._downloader.save_page_hashes()
+
+        self._downloader.download_assets(bad_page_numbers)
+
+        return self.verify(page_numbers=bad_page_numbers)
+
+    def _check_page(self, page_number: int):
+        """Checks a single page file. Returns a tuple of the problem (or None
+        if the page is OK) and whether there was a stored hash to check."""
+
+        page_file = self._downloader.get_page_file(page_number)
+        page_id = self._downloader.manual_metadata.get_page_id(page_number)
+
+        if not page_file.is_file():
+            return WebManualsCacheReport.MISSING, False
+
+        with page_file.open("rb") as stream:
+            file_contents = stream.read()
+        
+        if not file_contents.strip():
+            return WebManualsCacheReport.EMPTY, False
+
+        stored = self._downloader.page_hashes.get(page_number)
+        if stored:
+            if str(stored.get("page_id")) != str(page_id):
+                return WebManualsCacheReport.STALE, True
+            if stored.get("sha256") != hashlib.sha256(file_contents).hexdigest():
+                return WebManualsCacheReport.HASH_MISMATCH, True
+
+        try:
+            parser = WebManualsPageParser(page_file, page_id, page_number,
+                                          self._downloader.id)
+        except Exception:
+            return WebManualsCacheReport.UNPARSEABLE, bool(stored)
+
+        if not parser.has_content():
+            return WebManualsCacheReport.NO_CONTENT, bool(stored)
+
+        return None, bool(stored)
@@ -4,6 +4,7 @@ from pathlib import Path
 from time import time
 from manuals_diff import WebManualsServer
 from manuals_diff import WebManualsPageParser
+from manuals_diff import WebManualsCacheVerifier
 from manuals_diff.fsibuilder import FsiWebManualsManualBuilder
 
 OMA_MANUAL_ID = 5563
@@ -15,34 +16,58 @@ dest_dir = Path("/Users/gareth/Documents/Programming/eclipse-workspace-python/We
 #password = input("Password: ")
 server = WebManualsServer(cache_dir=dest_dir, offline=True)
 
+# If True, parse pages while the rest of the manual is still downloading rather
+# than downloading everything first
+PIPELINED = True
+
+# If True, check the downloaded pages for missing/corrupt files and re-download
+# any bad ones before building
+VERIFY = False
+
+fsi_file = dest_dir / "fsi.txt"
+
 start_time = time()
 
 #oma_downloader = server.get_manual(OMA_MANUAL_ID)
 #oma_dir = oma_downloader.download()
 
 fsi_downloader = server.get_manual(FSI_MANUAL_ID)
-fsi_dir = fsi_downloader.download()
-
-end_time = time()
-total_time = end_time - start_time
-print("Took {} seconds to download/check docs".format(total_time))
-print()
-print()
+fsi_manual_builder = FsiWebManualsManualBuilder(fsi_file, fsi_downloader)
 
-# Now parse a manual
-start_time = time()
+if VERIFY:
+    verifier = WebManualsCacheVerifier(fsi_downloader)
+    report = verifier.verify()
+    print(report)
+    if report.problems:
+        print(verifier.repair(report))
 
-# TODO: merge parser and builder. Traverse the pyquery tree directly to produce
-# wiki - specific markup. E.g.:
-#
-# parser = TikiWikiFsiWebManualsParser(fsi_downloader)
-# markup = parser.parse()
-# with fsi_file.open("w") as stream:
-#     print(markup, file=stream)
+if PIPELINED:
+    fsi_manual_builder.download_and_build()
+    end_time = time()
+    total_time = end_time - start_time
+    print("Took {} seconds to download/parse/concat pages".format(total_time))
 
-fsi_file = dest_dir / "fsi.txt"
-fsi_manual_builder = FsiWebManualsManualBuilder(fsi_file, fsi_downloader)
-fsi_manual_builder.build()
-end_time = time()
-total_time = end_time - start_time
-print("Took {} seconds to parse/concat pages".format(total_time))
+else:
+    fsi_dir = fsi_downloader.download()
+    
+    end_time = time()
+    total_time = end_time - start_time
+    print("Took {} seconds to download/check docs".format(total_time))
+    print()
+    print()
+    
+    # Now parse a manual
+    start_time = time()
+    
+    # TODO: merge parser and builder. Traverse the pyquery tree directly to produce
+    # wiki - specific markup. E.g.:
+    #
+    # parser = TikiWikiFsiWebManualsParser(fsi_downloader)
+    # markup = parser.parse()
+    # with fsi_file.open("w") as stream:
+    #     print(markup, file=stream)
+    
+    fsi_manual_builder.build()
+    end_time = time()
+    total_time = end_time - start_time
+    print("Took {} seconds to parse/concat pages".format(total_time))